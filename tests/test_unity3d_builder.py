@@ -0,0 +1,71 @@
+import asyncio
+import sys
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path, PureWindowsPath
+from tempfile import TemporaryDirectory
+from unity3d_builder import Unity3DBuilder
+
+
+class TestGetWslPath(unittest.TestCase):
+    def test_drive_letter(self):
+        self.assertEqual(Unity3DBuilder.get_wsl_path(PureWindowsPath("C:/Users/me/bin")), "/mnt/c/Users/me/bin")
+
+    def test_other_drive(self):
+        self.assertEqual(Unity3DBuilder.get_wsl_path(PureWindowsPath("D:/a b/c")), "/mnt/d/a b/c")
+
+    def test_backslashes(self):
+        self.assertEqual(Unity3DBuilder.get_wsl_path(PureWindowsPath("E:\\MyProject\\bin")), "/mnt/e/MyProject/bin")
+
+
+
+class TestReadLine(unittest.TestCase):
+    @staticmethod
+    def read_lines(data: bytes) -> list:
+        async def read() -> list:
+            stream = asyncio.StreamReader(limit=Unity3DBuilder.OUTPUT_LIMIT)
+            stream.feed_data(data)
+            stream.feed_eof()
+            lines = []
+            while True:
+                line = await Unity3DBuilder.read_line(stream)
+                if len(line) == 0:
+                    return lines
+                lines.append(line)
+        return asyncio.run(read())
+
+    def test_lines(self):
+        self.assertEqual(self.read_lines(b"a\nb\n"), [b"a\n", b"b\n"])
+
+    def test_long_line(self):
+        long_line = b"x" * (Unity3DBuilder.OUTPUT_LIMIT * 3 + 1) + b"\n"
+        self.assertEqual(self.read_lines(long_line + b"short\n"), [long_line, b"short\n"])
+
+    def test_no_trailing_newline(self):
+        self.assertEqual(self.read_lines(b"a\ntail"), [b"a\n", b"tail"])
+
+
+class TestRun(unittest.TestCase):
+    def test_long_line(self):
+        with TemporaryDirectory() as directory:
+            log_path = Path(directory).joinpath("run.log")
+            code = f"import sys; print('x' * {Unity3DBuilder.OUTPUT_LIMIT * 2}); sys.stdout.write('tail'); sys.exit(3)"
+            with redirect_stdout(StringIO()):
+                return_code = asyncio.run(Unity3DBuilder.run([sys.executable, "-c", code], "test", log_path))
+            self.assertEqual(return_code, 3)
+            self.assertEqual(log_path.read_text(encoding="utf-8"), "x" * Unity3DBuilder.OUTPUT_LIMIT * 2 + "\ntail\n")
+
+    def test_log_not_found(self):
+        # The log can't be opened, so the process is never started.
+        with TemporaryDirectory() as directory:
+            marker = Path(directory).joinpath("started")
+            code = f"open({str(marker)!r}, 'w').close()"
+            with self.assertRaises(FileNotFoundError):
+                asyncio.run(Unity3DBuilder.run([sys.executable, "-c", code], "test",
+                                               Path(directory).joinpath("missing/run.log")))
+            self.assertFalse(marker.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
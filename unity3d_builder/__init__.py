@@ -1 +1 @@
-from .unity3d_builder import Unity3DBuilder
+from .unity3d_builder import Unity3DBuilder, Platform
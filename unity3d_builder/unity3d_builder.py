@@ -1,6 +1,22 @@
-from subprocess import call
-from pathlib import Path
-from typing import List, Dict
+import asyncio
+from os import sep
+from shlex import quote
+from shutil import rmtree, which
+from pathlib import Path, PurePath
+from typing import List, Dict, Optional, NamedTuple
+
+
+class Platform(NamedTuple):
+    """
+    A build platform.
+    """
+
+    # The name of the platform, e.g. Windows
+    name: str
+    # The extension of the build, e.g. .exe
+    extension: str
+    # The Unity command line argument that creates the build, e.g. -buildWindows64Player
+    build_arg: str
 
 
 class Unity3DBuilder:
@@ -11,43 +27,131 @@ class Unity3DBuilder:
     """
 
     # Each platform, its extension, and the command line argument.
-    PLATFORMS = {"Windows": {"extension": ".exe", "call": "-buildWindows64Player"},
-                 "OSX": {"extension": ".app", "call": "-buildOSXUniversalPlayer"},
-                 "Linux": {"extension": ".x86_64", "call": "-buildLinux64Player"}}
+    PLATFORMS = (Platform("Windows", ".exe", "-buildWindows64Player"),
+                 Platform("OSX", ".app", "-buildOSXUniversalPlayer"),
+                 Platform("Linux", ".x86_64", "-buildLinux64Player"))
     # Use this argument when calling Unity.
     PROJECT_PATH_ARG = "-projectPath"
-    # Zip base call.
-    ZIP_CALL = ["wsl", "zip", "-rm"]
-
-    def __init__(self, project_path: str, dest_dir: str):
+    # 7-Zip base call. Create a .7z file with multi-threaded LZMA2.
+    ZIP_CALL = ["C:/Program Files/7-Zip/7z.exe", "a", "-t7z", "-m0=lzma2", "-mmt=on", "-r"]
+    # WSL tar base call. Unlike 7-Zip, tar keeps the executable permissions of the OS X and Linux builds.
+    # The command is a tar | pigz pipeline, which compresses with every core.
+    TAR_CALL = ["wsl", "--exec", "bash", "-c"]
+    # The buffer size for reading the output of a command. Longer lines are read in chunks.
+    OUTPUT_LIMIT = 1024 * 1024
+
+    def __init__(self, project_path: str, dest_dir: str, compression_level: int = 3):
         """
         :param project_path: The path to the Unity project.
         :param dest_dir: Output the standalone builds to this directory.
+        :param compression_level: The compression level, from 1 (fastest) to 9 (smallest file).
         """
 
-        home = str(Path.home().resolve())
-        if "~" in project_path:
-            project_path = project_path.replace("~", home)
-        if "~" in dest_dir:
-            dest_dir = dest_dir.replace("~", home)
-
-        self.project_path = Path(project_path)
-        assert self.project_path.exists(), f"Directory not found: {self.project_path.resolve()}"
+        # Resolve the paths once. Every path derived from them is absolute.
+        # This raises a FileNotFoundError if the project doesn't exist.
+        self.project_path = Path(project_path).expanduser().resolve(strict=True)
 
         self.project_name = self.project_path.stem
 
-        self.dest_dir = Path(dest_dir)
-        # Create the output directory.
-        if not self.dest_dir.exists():
-            self.dest_dir.mkdir(parents=True)
+        # Create the output directory before resolving it.
+        # On Windows before Python 3.10, resolve() returns a relative path unchanged if it doesn't exist.
+        self.dest_dir = Path(dest_dir).expanduser()
+        self.dest_dir.mkdir(parents=True, exist_ok=True)
+        self.dest_dir = self.dest_dir.resolve()
+
+        self.compression_level = compression_level
+
+        # If True, WSL 2 is installed.
+        self._wsl_available: bool = which("wsl") is not None
+
+        # The Unity version is read from the project settings file only once.
+        self._unity_version: Optional[str] = None
+        # The beginning of each Unity Editor call, including the project path.
+        self._unity_call_prefix: List[str] = self.get_unity_call() + [Unity3DBuilder.PROJECT_PATH_ARG,
+                                                                      str(self.project_path)]
+
+    @staticmethod
+    async def read_line(stream: asyncio.StreamReader) -> bytes:
+        """
+        Returns the next line of a stream, or an empty bytes object at the end of the stream.
+        Lines that are longer than the stream's buffer are read in chunks.
+
+        :param stream: The stream.
+        """
+
+        chunks: List[bytes] = []
+        while True:
+            try:
+                chunks.append(await stream.readuntil(b"\n"))
+                break
+            # The stream ended without a newline.
+            except asyncio.IncompleteReadError as e:
+                chunks.append(e.partial)
+                break
+            # The line is longer than the buffer. Read what's buffered and keep going.
+            except asyncio.LimitOverrunError as e:
+                chunks.append(await stream.readexactly(e.consumed))
+        return b"".join(chunks)
+
+    @staticmethod
+    async def run(args: List[str], platform: str, log_path: Path = None) -> int:
+        """
+        Run a command and print its output as it arrives.
+
+        :param args: The command.
+        :param platform: The name of the platform. Each line of output is prefixed with this.
+        :param log_path: If not None, write each line of output to this file too.
+
+        :return: The return code of the process.
+        """
+
+        # Open the log before starting the process so that a failure here can't leave the process running.
+        log = None if log_path is None else log_path.open("w", encoding="utf-8", buffering=1)
+        try:
+            process = await asyncio.create_subprocess_exec(*args,
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.STDOUT,
+                                                           limit=Unity3DBuilder.OUTPUT_LIMIT)
+        except BaseException:
+            if log is not None:
+                log.close()
+            raise
+        try:
+            while True:
+                line = await Unity3DBuilder.read_line(process.stdout)
+                if len(line) == 0:
+                    break
+                line = line.decode(errors="replace").rstrip()
+                print(f"[{platform}] {line}")
+                if log is not None:
+                    log.write(line + "\n")
+            return await process.wait()
+        except BaseException:
+            # Don't leave the process running if reading fails or the task is cancelled.
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            raise
+        finally:
+            if log is not None:
+                log.close()
 
     def get_unity_version(self) -> str:
         """
         Returns the Unity version of the TDWBase project.
         """
 
+        if self._unity_version is not None:
+            return self._unity_version
         p = self.project_path.joinpath("ProjectSettings/ProjectVersion.txt")
-        return p.read_text().split(": ")[1].split("\n")[0].strip()
+        # The version is on the first line, e.g. m_EditorVersion: 2020.3.1f1
+        with p.open("r", encoding="utf-8") as f:
+            line = f.readline()
+        self._unity_version = line.split(": ", 1)[1].strip()
+        return self._unity_version
 
     def get_editor_path(self) -> str:
         """
@@ -61,29 +165,30 @@ class Unity3DBuilder:
         Returns the beginning of a Unity Editor call.
         """
 
-        return [self.get_editor_path(), "-quit", "-batchmode"]
+        # -logFile - writes the Editor log to stdout instead of Editor.log
+        return [self.get_editor_path(), "-quit", "-batchmode", "-logFile", "-"]
 
-    def create_platform_directories(self) -> Dict[str, Path]:
+    def create_platform_directories(self) -> Dict[Platform, Path]:
         """
-        Create directories for each platform.
+        Create directories for each platform, e.g. Windows/MyProject
+        The build is created in the project-named subdirectory so that it can be zipped up without being renamed.
 
         :return: The path to each destination directory. Key = platform.
         """
 
-        platforms: Dict[str, Path] = {}
+        platforms: Dict[Platform, Path] = {}
         for platform in Unity3DBuilder.PLATFORMS:
-            platform_root_directory = self.dest_dir.joinpath(platform)
-            if not platform_root_directory.exists():
-                platform_root_directory.mkdir()
+            platform_root_directory = self.dest_dir.joinpath(platform.name, self.project_name)
+            platform_root_directory.mkdir(parents=True, exist_ok=True)
             platforms.update({platform: platform_root_directory})
         print(f"Created platform directories.")
         return platforms
 
-    def create_build(self, platform: str, platform_path: Path, exe_name: str = None) -> None:
+    async def create_build(self, platform: Platform, platform_path: Path, exe_name: str = None) -> None:
         """
         Create the build for a platform.
 
-        :param platform: The platform directory.
+        :param platform: The platform.
         :param platform_path: The path to the platform directory.
         :param exe_name: The name of the executable. If None, use the project name.
         """
@@ -91,88 +196,170 @@ class Unity3DBuilder:
         if exe_name is None:
             exe_name = self.project_name
 
-        build_path = platform_path.joinpath(f"{exe_name}{Unity3DBuilder.PLATFORMS[platform]['extension']}")
+        # platform_path is already absolute, so the build path can be assembled as a string.
+        build_path = f"{platform_path}{sep}{exe_name}{platform.extension}"
 
-        build_call = self.get_unity_call()[:]
-        build_call.extend([Unity3DBuilder.PROJECT_PATH_ARG,
-                           str(self.project_path.resolve()),
-                           Unity3DBuilder.PLATFORMS[platform]["call"],
-                           str(build_path.resolve())])
-        print(f"Creating build for {platform}...")
-        call(build_call)
+        build_call = self._unity_call_prefix + [platform.build_arg, build_path]
+        # Write the build log next to the compressed file, e.g. MyProject_Windows.log
+        log_path = self.dest_dir.joinpath(f"{self.project_name}_{platform.name}.log")
+        print(f"Creating build for {platform.name}... Log: {log_path}")
+        return_code = await Unity3DBuilder.run(build_call, platform.name, log_path)
 
         print("...Done!")
-        assert build_path.exists(), "Failed to create build."
+        # A build left over from a previous run might exist, so check the return code too.
+        assert return_code == 0, f"Failed to create build: {build_path}"
+        assert Path(build_path).exists(), f"Failed to create build: {build_path}"
 
-    def zip(self, platform: str) -> Path:
+    @staticmethod
+    def get_wsl_path(p: PurePath) -> str:
+        """
+        Returns the path as seen from WSL, e.g. /mnt/c/Users/...
+
+        :param p: The absolute Windows path. This can be a PureWindowsPath on other operating systems.
+        """
+
+        return f"/mnt/{p.drive[0].lower()}{p.as_posix()[2:]}"
+
+    async def zip(self, platform: Platform, source: Path) -> Path:
         """
         Zip up the build.
+        OS X and Linux builds are compressed to a .tar.gz file with WSL if it's installed.
+        Otherwise, the build is compressed to a .7z file with 7-Zip.
+
+        :param platform: The platform.
+        :param source: The directory to zip up, e.g. Windows/MyProject
 
-        :param platform: The name of the platform.
+        :return: The path to the compressed file.
         """
 
-        # Get the current destination directory, e.g. Windows
-        p = self.dest_dir.joinpath(platform)
-        # Change the name of the directory to the project name, e.g. MyProject
-        p.replace(self.dest_dir.joinpath(self.project_name))
-        p = self.dest_dir.joinpath(self.project_name)
-        # Get the zip file name, e.g. MyProject_Windows.zip
-        dest = self.dest_dir.joinpath(f"{self.project_name}_{platform}.zip")
+        if platform.name != "Windows" and self._wsl_available:
+            dest = await self.tar(platform, source)
+        else:
+            # Get the zip file name, e.g. MyProject_Windows.7z
+            dest = self.dest_dir.joinpath(f"{self.project_name}_{platform.name}.7z")
+            # 7z a adds to an existing archive, so remove the archive from a previous run.
+            dest.unlink(missing_ok=True)
+
+            # Create the zip file.
+            zip_call = [*Unity3DBuilder.ZIP_CALL,
+                        f"-mx={self.compression_level}",
+                        str(dest),
+                        str(source)]
+            return_code = await Unity3DBuilder.run(zip_call, platform.name)
+            assert return_code == 0, f"Failed to compress build: {dest}"
+        assert dest.exists(), f"Failed to compress build: {dest}"
+
+        # Remove the platform directory, e.g. Windows, in one pass after compressing it.
+        # This runs in a worker thread so that the next build doesn't wait for it.
+        await asyncio.get_running_loop().run_in_executor(None, rmtree, str(source.parent))
 
-        # Create the zip file.
-        zip_call = Unity3DBuilder.ZIP_CALL[:]
-        zip_call.extend([str(dest.resolve()),
-                         str(p.resolve()),
-                         "-sdel"])
-        call(zip_call)
+        return dest
+
+    async def tar(self, platform: Platform, source: Path) -> Path:
+        """
+        Compress the build to a .tar.gz file with WSL tar and pigz (parallel gzip).
+
+        :param platform: The platform.
+        :param source: The directory to compress, e.g. OSX/MyProject
+
+        :return: The path to the compressed file.
+        """
+
+        # Get the file name, e.g. MyProject_OSX.tar.gz
+        dest = self.dest_dir.joinpath(f"{self.project_name}_{platform.name}.tar.gz")
+
+        tar_call = [*Unity3DBuilder.TAR_CALL,
+                    f"set -o pipefail; "
+                    f"tar -C {quote(Unity3DBuilder.get_wsl_path(source.parent))} -cf - {quote(source.name)} | "
+                    f"pigz -p $(nproc) -{self.compression_level} > {quote(Unity3DBuilder.get_wsl_path(dest))}"]
+        # The output file is created even if the pipeline fails, so check the return code.
+        return_code = await Unity3DBuilder.run(tar_call, platform.name)
+        assert return_code == 0, f"Failed to compress build: {dest}"
 
         return dest
 
-    def chmod(self, platform: str) -> None:
+    def get_executables(self, platform: Platform) -> List[Path]:
+        """
+        Returns the files in a build that need to be made executable.
+
+        :param platform: The platform.
+        """
+
+        if platform.name == "Windows":
+            return []
+        elif platform.name == "OSX":
+            # Every binary in the app bundle, e.g. MyProject.app/Contents/MacOS/MyProject
+            p = self.dest_dir.joinpath(f"OSX/{self.project_name}/{self.project_name}.app/Contents/MacOS")
+            assert p.exists(), f"Directory not found: {p}"
+            return [f for f in p.iterdir() if f.is_file()]
+        elif platform.name == "Linux":
+            p = self.dest_dir.joinpath(f"Linux/{self.project_name}/{self.project_name}.x86_64")
+            assert p.exists(), f"File not found: {p}"
+            return [p]
+        else:
+            raise Exception(f"Platform not supported: {platform.name}")
+
+    async def chmod(self, platforms: List[Platform]) -> None:
         """
-        Run wsl chmod +x
+        Run wsl chmod +x on the executables of each build with a single WSL call.
         Ignored if WSL 2 is not installed.
 
-        :param platform: The name of the platform.
+        :param platforms: The platforms.
         """
 
-        if platform == "Windows":
+        if not self._wsl_available:
             return
 
-        if platform == "OSX":
-            p = self.dest_dir.joinpath(f"OSX/{self.project_name}.app/Contents/MacOS/{self.project_name}")
-        elif platform == "Linux":
-            p = self.dest_dir.joinpath(f"Linux/{self.project_name}.x86_64")
-        else:
-            raise Exception(f"Platform not supported: {platform}")
-
-        assert p.exists(), f"File not found: {p.resolve()}"
-        try:
-            p = str(p.resolve())
-            p = f"/mnt/c/{p[2:]}".replace("\\", "/")
-            call(["wsl", "chmod", "+x", p])
-        except FileNotFoundError:
+        paths: List[str] = []
+        for platform in platforms:
+            paths.extend([Unity3DBuilder.get_wsl_path(p) for p in self.get_executables(platform)])
+        if len(paths) == 0:
             return
+        # --exec runs chmod without the shell, so the paths aren't reinterpreted.
+        return_code = await Unity3DBuilder.run(["wsl", "--exec", "chmod", "+x", *paths], "chmod")
+        # Without the executable bit, the OS X and Linux builds won't run.
+        assert return_code == 0, "Failed to run chmod +x"
 
-    def create(self) -> None:
+    async def create_async(self) -> Dict[str, Path]:
         """
         Create each standalone build and zip it up.
+
+        Unity locks the project while it is open, so the builds are created one at a time.
+        The Windows build is zipped up while the other builds are being created.
+        Then, chmod +x runs on the OS X and Linux builds, and they are zipped up.
+
+        :return: The path to each compressed file. Key = platform.
         """
 
         platform_directories = self.create_platform_directories()
 
-        zip_files: Dict[str, Path] = {}
-
-        for platform_dir in platform_directories:
+        zip_tasks: Dict[str, asyncio.Task] = {}
+        chmod_platforms: List[Platform] = []
+        for platform in platform_directories:
             # Create the build.
-            self.create_build(platform_dir, platform_directories[platform_dir])
-            # Run chmod +x
-            self.chmod(platform=platform_dir)
-
-            # Zip everything up.
-            zip_file = self.zip(platform_dir)
-            zip_files.update({platform_dir: zip_file})
+            await self.create_build(platform, platform_directories[platform])
+            if platform.name == "Windows":
+                # Zip up the build while the next build is being created.
+                zip_tasks.update({platform.name: asyncio.create_task(self.zip(platform,
+                                                                              platform_directories[platform]))})
+            else:
+                chmod_platforms.append(platform)
+        # Run chmod +x
+        await self.chmod(chmod_platforms)
+        # Zip everything up.
+        for platform in chmod_platforms:
+            zip_tasks.update({platform.name: asyncio.create_task(self.zip(platform,
+                                                                          platform_directories[platform]))})
+        zip_files = await asyncio.gather(*zip_tasks.values())
         print("DONE!")
+        return dict(zip(zip_tasks, zip_files))
+
+    def create(self) -> None:
+        """
+        Create each standalone build and zip it up.
+        """
+
+        asyncio.run(self.create_async())
 
 
 if __name__ == "__main__":